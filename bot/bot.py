@@ -1,14 +1,14 @@
 # 2020 Emir Erbasan (humanova)
 # MIT License, see LICENSE for more details
 
-import sys
-import traceback
 import discord
 from discord.ext import commands
 from discord.ext.commands import AutoShardedBot, DefaultHelpCommand
-from utils import permissions
+from utils import permissions, logger
 from datetime import datetime
 
+log = logger.get("bot")
+
 init_extensions = ['cogs.owner',
                    'cogs.info',
                    'cogs.dchess']
@@ -65,9 +65,14 @@ class Bot(AutoShardedBot):
 
         self.boot_time = datetime.now()
 
+    def ctx_log_extra(self, ctx):
+        if ctx.guild is None:
+            return {}
+        return {"guild_id": ctx.guild.id, "shard_id": ctx.guild.shard_id}
+
     async def on_ready(self):
-        print(f"Ready : {self.user.name} -- {self.user.id}")
-        print(f"Shards : {self.shard_count}")
+        log.info("Ready : %s -- %s", self.user.name, self.user.id)
+        log.info("Shards : %s", self.shard_count)
         await self.change_presence(status=discord.Status.online, activity=discord.Game("!help"))
 
 
@@ -83,11 +88,9 @@ class Bot(AutoShardedBot):
         elif isinstance(error, commands.DisabledCommand):
             await ctx.author.send('Command is disabled.')
         elif isinstance(error, commands.CommandInvokeError):
-            print(error)
-            print(f'In {ctx.command.qualified_name}:', file=sys.stderr)
-            traceback.print_tb(error.original.__traceback__)
-            print(f'{error.original.__class__.__name__}: {error.original}', file=sys.stderr)
+            log.error("In %s: %s", ctx.command.qualified_name, error, exc_info=error.original,
+                      extra=self.ctx_log_extra(ctx))
         elif isinstance(error, commands.CommandNotFound):
             return
         else:
-            print(f'{error}', file=sys.stderr)
\ No newline at end of file
+            log.error("%s", error, extra=self.ctx_log_extra(ctx))
\ No newline at end of file
@@ -1,8 +1,10 @@
 # 2020 Emir Erbasan (humanova)
 # MIT License, see LICENSE for more details
+import asyncio
 import discord
 import requests
-from utils import confparser, permissions, default
+from utils import confparser, permissions, default, logger
+from utils.outbox import Outbox
 from discord.ext import tasks, commands
 from io import BytesIO
 import time
@@ -17,18 +19,36 @@ end_status = {
     'resign' : 'Resign',
     'stalemate' : 'Stalemate'
 }
+log = logger.get("cogs.dchess")
 
 class DChess(commands.Cog):
 
-    def __init__(self, bot):
+    def __init__(self, bot, outbox_path: str = None, start_loops: bool = True):
         self.bot = bot
         self.config = confparser.get("config.json")
         self.games = []
+        self.outbox = Outbox(outbox_path or getattr(self.config, "outbox_path", "outbox.json"))
+        self.recorder = None
 
-        self.chess_task_loop.start()
+        # replay.py builds the cog with its own outbox and drives the loops itself
+        if start_loops:
+            self.chess_task_loop.start()
+            self.outbox_task_loop.start()
 
     def cog_unload(self):
         self.chess_task_loop.cancel()
+        self.outbox_task_loop.cancel()
+        if self.recorder:
+            self.recorder.detach()
+
+    async def cog_before_invoke(self, ctx):
+        if self.recorder:
+            self.recorder.record_command(ctx)
+
+    def record_game_event(self, name: str, message_id: int, **fields):
+        # only events on game messages are worth replaying
+        if self.recorder and any(message_id == g["msg"].id for g in self.games):
+            self.recorder.record_event(name, message_id=message_id, **fields)
 
     def get_destination(self, no_pm: bool = False):
         if no_pm:
@@ -36,6 +56,13 @@ class DChess(commands.Cog):
         else:
             return self.context.author
 
+    def game_log_extra(self, game: dict):
+        return {"game_id": game["match_id"], "guild_id": game["guild_id"], "shard_id": game["msg"].guild.shard_id}
+
+    def mention_position(self, content: str, member: discord.Member):
+        positions = [content.find(f"<@{member.id}>"), content.find(f"<@!{member.id}>")]
+        return min([p for p in positions if p >= 0], default=len(content))
+
     def parse_clock_setting(self, clock:str):
         try:
             s = clock.split("+")
@@ -61,9 +88,10 @@ class DChess(commands.Cog):
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "create_match"})
 
-    async def send_update_match_request(self, match_id: str, result: str, white_id :str, black_id: str):
+    def post_update_match(self, match_id: str, result: str, white_id :str, black_id: str):
+        # blocking, run it through run_in_executor
         content = {"match_id": match_id,
                    "match_result": result,
                    "white_id": white_id,
@@ -73,16 +101,26 @@ class DChess(commands.Cog):
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "update_match", "game_id": match_id})
 
-    async def send_update_match_end_request(self, match_id: str):
+    async def send_update_match_request(self, match_id: str, result: str, white_id :str, black_id: str):
+        return await self.bot.loop.run_in_executor(None, self.post_update_match, match_id, result, white_id, black_id)
+
+    def post_update_match_end(self, match_id: str):
+        # blocking, run it through run_in_executor
         content = {"match_id": match_id}
         try:
             r = requests.post(f"{API_URL}/update_match_end", timeout=4.0, json=content)
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "update_match_end", "game_id": match_id})
+
+    async def send_update_match_end_request(self, match_id: str):
+        return await self.bot.loop.run_in_executor(None, self.post_update_match_end, match_id)
+
+    async def send_outbox_item(self, endpoint: str, content: dict):
+        return await getattr(self, f"send_{endpoint}_request")(**content)
 
     async def send_get_match_request(self, match_id: str):
         content = { "match_id": match_id}
@@ -91,9 +129,10 @@ class DChess(commands.Cog):
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "get_match"})
 
-    async def send_get_player_request(self, player_id, guild_id=None):
+    def post_get_player(self, player_id, guild_id=None):
+        # blocking, run it through run_in_executor
         content = {"player_id": player_id}
         if guild_id:
             content.update(guild_id=guild_id)
@@ -102,7 +141,15 @@ class DChess(commands.Cog):
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "get_player", "guild_id": guild_id})
+
+    async def send_get_player_request(self, player_id, guild_id=None):
+        return await self.bot.loop.run_in_executor(None, self.post_get_player, player_id, guild_id)
+
+    async def send_get_players_request(self, player_ids: list, guild_id=None):
+        # service has no bulk endpoint, so fetch concurrently
+        return await asyncio.gather(*[self.bot.loop.run_in_executor(None, self.post_get_player, p_id, guild_id)
+                                      for p_id in player_ids])
 
     async def send_get_guild_request(self, guild_id):
         content = { "guild_id": guild_id}
@@ -111,7 +158,7 @@ class DChess(commands.Cog):
             response = r.json()
             return response
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "get_guild"})
 
     # returns png obj
     async def send_get_match_preview_request(self, match_id: str, move):
@@ -119,7 +166,7 @@ class DChess(commands.Cog):
             r = requests.get(f"{API_URL}/get_match_preview/{match_id}/{move}.png", timeout=4.0)
             return BytesIO(r.content)
         except Exception as e:
-            print(e)
+            log.warning("request failed : %s", e, extra={"endpoint": "get_match_preview"})
 
     async def send_error_embed(self, ctx, message, fields=None):
         if fields is None: fields = []
@@ -141,7 +188,7 @@ class DChess(commands.Cog):
         except (discord.Forbidden, discord.NotFound):
             pass
         except Exception as e:
-            print(f"error while canceling game : {e}")
+            log.error("error while canceling game : %s", e, extra=self.game_log_extra(game))
 
     async def send_game_invite_embed(self, ctx, member: discord.Member, match_data, is_dm:bool=False, show_clock:bool=False):
         match = match_data
@@ -192,6 +239,23 @@ class DChess(commands.Cog):
         else:
             return None
 
+    async def get_players_stat_embed(self, players: list, guild: discord.Guild):
+        pls = await self.send_get_players_request([p.id for p in players], guild.id)
+        embed = discord.Embed(title="Stats", color=0x00ffff)
+        not_found = []
+        for player, pl in zip(players, pls):
+            if pl and pl['success']:
+                embed.add_field(name=str(player),
+                                value=f"Guild Elo : {int(pl['guild_player']['elo'])}\n"
+                                      f"Matches : {pl['player']['matches']}\n"
+                                      f"W/D/L : {pl['player']['wins']}/{pl['player']['draws']}/{pl['player']['loses']}",
+                                inline=True)
+            else:
+                not_found.append(f"<@{player.id}>")
+        if not_found:
+            embed.add_field(name="Couldn't find", value=" ".join(not_found), inline=False)
+        return embed
+
     @tasks.loop(seconds=1)
     async def chess_task_loop(self):
         if len(self.games) > 0:
@@ -246,7 +310,8 @@ class DChess(commands.Cog):
                                 await self.cancel_game(game)
 
                         elif status in end_status:
-                            m_data = await self.send_update_match_end_request(match_id=game["match_id"])
+                            self.outbox.put("update_match_end", game["match_id"], {"match_id": game["match_id"]},
+                                            immediate=True)
 
                             embed.add_field(name="Status", value=end_status[status], inline=False)
                             if not status == "draw" and not status == "stalemate":
@@ -264,7 +329,14 @@ class DChess(commands.Cog):
                             self.games.remove(game)
                         game["move_count"] = move_count
                 except Exception as e:
-                    print(f"Error in chess task loop : {e}")
+                    log.exception("error in chess task loop : %s", e, extra=self.game_log_extra(game))
+
+    @tasks.loop(seconds=2)
+    async def outbox_task_loop(self):
+        try:
+            await self.outbox.flush(self.send_outbox_item)
+        except Exception as e:
+            log.exception("error in outbox task loop : %s", e)
 
 
     @commands.command()
@@ -294,6 +366,8 @@ class DChess(commands.Cog):
                 msg = await self.send_game_invite_embed(ctx, member=member, match_data=match, is_dm=False)
                 await msg.add_reaction('⚪')
                 await msg.add_reaction('⚫')
+                if self.recorder:
+                    self.recorder.record_event("game_created", match_id=match["db_match"]["id"], message_id=msg.id)
 
                 match_id = match["db_match"]["id"]
                 match_url = f"https://lichess.org/{match_id}"
@@ -320,7 +394,8 @@ class DChess(commands.Cog):
                                    "white_id": None,
                                    "black_id": None,})
         except Exception as e:
-            print(f"error while creating match : {e}")
+            log.exception("error while creating match : %s", e,
+                          extra={"guild_id": ctx.guild.id, "shard_id": ctx.guild.shard_id})
 
     @commands.command()
     @commands.guild_only()
@@ -329,6 +404,7 @@ class DChess(commands.Cog):
             Usage:
                 - !cstats
                 - !cstats @player
+                - !cstats @player1 @player2 ...
                 - !cstats guild
         """
         if not arg:
@@ -338,13 +414,20 @@ class DChess(commands.Cog):
             else:
                 await self.send_error_embed(ctx, message="Couldn't find mentioned player.")
         elif arg:
-            if ctx.message.mentions:
-                for m in ctx.message.mentions:
-                    embed = await self.get_player_stat_embed(m, ctx.guild)
-                    if embed:
-                        await ctx.send(embed=embed)
-                    else:
-                        await self.send_error_embed(ctx, message="Couldn't find mentioned player.")
+            if len(ctx.message.mentions) == 1:
+                embed = await self.get_player_stat_embed(ctx.message.mentions[0], ctx.guild)
+                if embed:
+                    await ctx.send(embed=embed)
+                else:
+                    await self.send_error_embed(ctx, message="Couldn't find mentioned player.")
+            elif ctx.message.mentions:
+                # discord doesn't keep mention order, sort by position in the message
+                mentions = sorted(ctx.message.mentions, key=lambda m: self.mention_position(ctx.message.content, m))
+                # one combined embed, at most 24 players (embed field limit)
+                embed = await self.get_players_stat_embed(mentions[:24], ctx.guild)
+                if len(mentions) > 24:
+                    embed.set_footer(text=f"{len(mentions) - 24} more players left out, at most 24 per message.")
+                await ctx.send(embed=embed)
             elif arg == "guild":
                 g = await self.send_get_guild_request(ctx.guild.id)
                 if g['success'] and len(g['guild']) > 0:
@@ -381,12 +464,14 @@ class DChess(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message_delete(self, message):
+        self.record_game_event("message_delete", message.id)
         game = [g for g in self.games if message.id == g['msg'].id]
         if game:
             await self.cancel_game(game[0])
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
+        self.record_game_event("reaction_add", reaction.message.id, emoji=str(reaction.emoji), user=user)
         for g in self.games:
             if user.id == g["host"].id or user.id == g["guest"].id:
                 if reaction.message.id == g["msg"].id:
@@ -403,13 +488,15 @@ class DChess(commands.Cog):
 
                     if g["white_id"] is not None and g["black_id"] is not None:
                         if not g["white_id"] == g["black_id"]:
-                            match = await self.send_update_match_request(match_id=g["match_id"], result="unfinished",
-                                                                         white_id=g["white_id"], black_id=g["black_id"])
-                            #if match["success"]:
-                            #    print("successfully updated match")
+                            # debounced, only the last color selection is sent
+                            self.outbox.put("update_match", g["match_id"], {"match_id": g["match_id"],
+                                                                            "result": "unfinished",
+                                                                            "white_id": g["white_id"],
+                                                                            "black_id": g["black_id"]})
 
     @commands.Cog.listener()
     async def on_reaction_remove(self, reaction, user):
+        self.record_game_event("reaction_remove", reaction.message.id, emoji=str(reaction.emoji), user=user)
         for g in self.games:
             if user.id == g["host"].id or user.id == g["guest"].id:
                 if reaction.message.id == g["msg"].id:
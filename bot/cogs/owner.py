@@ -2,16 +2,25 @@
 # MIT License, see LICENSE for more details
 
 import os
+import asyncio
+import time
 import discord
 from discord.ext import commands
 import codecs
-from utils import confparser, default, permissions
+import gzip
+from io import BytesIO
+from tabulate import tabulate
+from utils import confparser, default, permissions, profiler, traffic
+
+# uncompressed cap for the collapsed stack attachment, stays well under discord's upload limit once gzipped
+MAX_PROFILE_SIZE = 7 * 1024 ** 2
 
 class Owner(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
         self.config = confparser.get("config.json")
+        self.profiler = None
 
     @commands.command()
     @commands.bot_has_permissions(manage_messages=True)
@@ -71,6 +80,70 @@ class Owner(commands.Cog):
 
         await ctx.send("Successfully reloaded all extensions")
 
+    @commands.command()
+    @commands.check(permissions.is_owner)
+    async def profile(self, ctx, seconds: float = 10.0, top: int = 10):
+        """ Samples the event loop thread's CPU time for N seconds (max 60),
+            sends top hotspots and a gzipped collapsed stack file
+            Usage:
+                - !profile
+                - !profile 30 15
+        """
+        if self.profiler is not None:
+            return await ctx.send("A profile is already running.")
+
+        seconds = max(1.0, min(seconds, profiler.MAX_DURATION))
+        top = max(1, min(top, 20))
+        # claim and start before the first await so a second !profile can't slip in
+        p = profiler.SamplingProfiler()
+        self.profiler = p
+        try:
+            p.start(seconds)
+            await ctx.send(f"Profiling for **{seconds:.0f}s**...")
+            await asyncio.sleep(seconds)
+            p.stop()
+
+            if p.sample_count == 0:
+                return await ctx.send("No samples collected.")
+
+            total = p.total_weight
+            rows = [[frame[:60], f"{self_c / total:.1%}", f"{total_c / total:.1%}"]
+                    for frame, self_c, total_c in p.hotspots(top)]
+            table_str = tabulate(rows, headers=["Frame", "Self", "Total"])
+            collapsed, left_out = p.collapsed(max_bytes=MAX_PROFILE_SIZE)
+            fp = BytesIO(gzip.compress(collapsed.encode('utf8')))
+            note = f" ({left_out} least frequent stacks left out)" if left_out else ""
+            await ctx.send(f"**{p.sample_count}** samples in **{p.elapsed:.1f}s**{note}```{table_str}```",
+                           file=discord.File(fp=fp, filename=f"profile_{int(time.time())}.folded.gz"))
+        finally:
+            p.stop()
+            self.profiler = None
+
+    @commands.command()
+    @commands.check(permissions.is_owner)
+    async def record(self, ctx, action: str):
+        """ Records DChess service requests and events for offline replay (python replay.py <file>)
+            Usage:
+                - !record start
+                - !record stop
+        """
+        cog = self.bot.get_cog("DChess")
+        if cog is None:
+            return await ctx.send("DChess cog isn't loaded.")
+
+        if action == "start":
+            if cog.recorder:
+                return await ctx.send(f"Already recording to **{cog.recorder.path}**")
+            path = f"traffic_{int(time.time())}.jsonl.gz"
+            traffic.Recorder(path).attach(cog)
+            await ctx.send(f"Recording to **{path}**")
+        elif action == "stop":
+            recorder = cog.recorder
+            if not recorder:
+                return await ctx.send("Not recording.")
+            recorder.detach()
+            await ctx.send(f"Recorded **{recorder.count}** records to **{recorder.path}**")
+
     @commands.command()
     @commands.check(permissions.is_owner)
     async def servers(self, ctx):
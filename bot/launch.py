@@ -2,10 +2,10 @@
 # MIT License, see LICENSE for more details
 
 import bot
-from utils import confparser, permissions
+from utils import confparser, permissions, logger
 config = confparser.get("config.json")
 
-
-print("Logging in...")
+logger.setup(getattr(config, "log_path", "logs/dchess.log"))
+logger.get().info("Logging in...")
 _bot = bot.Bot(command_prefix=config.prefix, prefix=config.prefix, command_attrs=dict(hidden=True))
 _bot.run(config.token)
\ No newline at end of file
@@ -0,0 +1,309 @@
+# 2020 Emir Erbasan (humanova)
+# MIT License, see LICENSE for more details
+
+# Replays a capture made with `!record` against the DChess cog and a local service stub
+# Usage:
+#       - python replay.py traffic_1600000000.jsonl.gz
+#       - python replay.py traffic_1600000000.jsonl.gz --speed 10
+#       - python replay.py traffic_1600000000.jsonl.gz --speed 0   (as fast as possible)
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from io import BytesIO
+from types import SimpleNamespace
+from tabulate import tabulate
+import cogs.dchess
+import utils.outbox
+from cogs.dchess import DChess
+from utils import traffic
+
+
+class VirtualClock:
+    """ Stands in for the `time` module in the cog and the outbox, so timeouts and debounce follow recorded time """
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class StubMember:
+
+    def __init__(self, replay, member_id, name):
+        self.replay = replay
+        self.id = member_id
+        self.name = name.split("#")[0]
+        self.full_name = name
+
+    def __str__(self):
+        return self.full_name
+
+    async def send(self, content=None, **kwargs):
+        self.replay.counters["dm"] += 1
+
+
+class StubGuild:
+
+    def __init__(self, replay, guild_id, name):
+        self.replay = replay
+        self.id = guild_id
+        self.name = name
+        self.shard_id = 0
+
+    def __str__(self):
+        return self.name
+
+    def get_member(self, member_id):
+        return self.replay.members.get(member_id)
+
+
+class StubChannel:
+
+    def __init__(self, replay, channel_id, guild):
+        self.replay = replay
+        self.id = channel_id
+        self.guild = guild
+
+    async def send(self, content=None, **kwargs):
+        self.replay.counters["send"] += 1
+        return self.replay.new_message(self)
+
+
+class StubMessage:
+
+    def __init__(self, replay, message_id, channel):
+        self.replay = replay
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild if channel else None
+
+    async def edit(self, **kwargs):
+        self.replay.counters["edit"] += 1
+
+    async def delete(self):
+        self.replay.counters["delete"] += 1
+
+    async def add_reaction(self, emoji):
+        self.replay.counters["add_reaction"] += 1
+
+
+class ServiceStub:
+    """ Answers send_*_request calls with the latest response recorded for the same arguments at or before
+        the current replay time, so responses follow the capture's timeline rather than the call count
+    """
+
+    def __init__(self, replay, records):
+        self.replay = replay
+        # key -> ([recorded t], [response]), records are already sorted by t
+        self.responses = defaultdict(lambda: ([], []))
+        self.name_responses = defaultdict(lambda: ([], []))
+        for r in records:
+            if r["kind"] == "request":
+                for entries in (self.responses[self.key(r["name"], r["args"], r["kwargs"])],
+                                self.name_responses[r["name"]]):
+                    entries[0].append(r["t"])
+                    entries[1].append(r["response"])
+
+    @staticmethod
+    def key(name, args, kwargs):
+        return json.dumps([name, args, kwargs], sort_keys=True)
+
+    @staticmethod
+    def at(entries, t):
+        # calls before the first recorded one get the first response
+        i = bisect.bisect_right(entries[0], t)
+        return entries[1][max(i - 1, 0)]
+
+    def method(self, name):
+        async def call(*args, **kwargs):
+            self.replay.counters[f"request:{name}"] += 1
+            t = self.replay.clock.now - self.replay.start_wall
+            entries = self.responses.get(self.key(name, traffic.encode(args), traffic.encode(kwargs)))
+            if entries:
+                response = self.at(entries, t)
+            else:
+                self.replay.counters["request:unmatched"] += 1
+                response = self.at(self.name_responses[name], t) if self.name_responses.get(name) else None
+            if isinstance(response, dict) and "__bytes__" in response:
+                return BytesIO()
+            return response
+        return call
+
+
+class Replay:
+
+    def __init__(self, records, speed=1.0):
+        self.records = records
+        self.speed = speed
+        self.counters = Counter()
+        self.tick_times = []
+        self.members = {}
+        self.guilds = {}
+        self.messages = {}
+        self.message_id = 0
+        self.cog = None
+        start = next((r for r in records if r["kind"] == "start"), None)
+        self.start_wall = start["wall"] if start else time.time()
+        self.clock = VirtualClock(self.start_wall)
+
+    def member(self, data):
+        if data["id"] not in self.members:
+            self.members[data["id"]] = StubMember(self, data["id"], data["name"])
+        return self.members[data["id"]]
+
+    def guild(self, data):
+        if data["id"] not in self.guilds:
+            self.guilds[data["id"]] = StubGuild(self, data["id"], data["name"])
+        return self.guilds[data["id"]]
+
+    def message(self, message_id):
+        if message_id not in self.messages:
+            self.messages[message_id] = StubMessage(self, message_id, None)
+        return self.messages[message_id]
+
+    def new_message(self, channel):
+        self.message_id += 1
+        return StubMessage(self, self.message_id, channel)
+
+    def decode_arg(self, arg):
+        if isinstance(arg, dict) and "id" in arg and "name" in arg:
+            return self.member(arg)
+        return arg
+
+    def setup_cog(self, loop, outbox_path):
+        cogs.dchess.time = self.clock
+        utils.outbox.time = self.clock
+
+        bot = SimpleNamespace(user=SimpleNamespace(avatar_url=""), loop=loop)
+        cog = DChess(bot, outbox_path=outbox_path, start_loops=False)
+
+        stub = ServiceStub(self, self.records)
+        for name in traffic.request_methods(cog):
+            setattr(cog, name, stub.method(name))
+        self.cog = cog
+
+    async def dispatch(self, record):
+        cog = self.cog
+        if record["kind"] == "snapshot":
+            # games that were already running when recording started
+            for snapshot in record["games"]:
+                guild = self.guild(snapshot["guild"])
+                msg = StubMessage(self, snapshot["message_id"], StubChannel(self, snapshot["channel_id"], guild))
+                self.messages[msg.id] = msg
+                game = {k: v for k, v in snapshot.items() if k not in ("message_id", "channel_id", "guild")}
+                game.update(msg=msg, host=self.member(game["host"]), guest=self.member(game["guest"]))
+                cog.games.append(game)
+
+        elif record["kind"] == "command":
+            guild = self.guild(record["guild"])
+            channel = StubChannel(self, record["channel_id"], guild)
+            message = SimpleNamespace(mentions=[self.member(m) for m in record["mentions"]],
+                                      content=" ".join(f"<@{m['id']}>" for m in record["mentions"]))
+            ctx = SimpleNamespace(author=self.member(record["author"]),
+                                  guild=guild,
+                                  channel=channel,
+                                  message=message,
+                                  send=channel.send)
+            args = [self.decode_arg(a) for a in record["args"]]
+            kwargs = {k: self.decode_arg(v) for k, v in record["kwargs"].items()}
+            self.counters[f"command:{record['name']}"] += 1
+            try:
+                await getattr(DChess, record["name"]).callback(cog, ctx, *args, **kwargs)
+            except Exception as e:
+                self.counters["command_error"] += 1
+                print(f"error while replaying {record['name']} : {e}")
+
+        elif record["name"] == "game_created":
+            # map the recorded invite message to the stub message the cog created
+            for g in cog.games:
+                if g["match_id"] == record["match_id"]:
+                    self.messages[record["message_id"]] = g["msg"]
+
+        elif record["name"] == "message_delete":
+            await cog.on_message_delete(self.message(record["message_id"]))
+
+        elif record["name"] in ("reaction_add", "reaction_remove"):
+            reaction = SimpleNamespace(message=self.message(record["message_id"]), emoji=record["emoji"])
+            await getattr(cog, f"on_{record['name']}")(reaction, self.member(record["user"]))
+
+    async def chess_tick(self):
+        t0 = time.perf_counter()
+        await self.cog.chess_task_loop.coro(self.cog)
+        self.tick_times.append(time.perf_counter() - t0)
+
+    async def outbox_tick(self):
+        await self.cog.outbox.flush(self.cog.send_outbox_item)
+
+    async def run(self):
+        started = time.perf_counter()
+
+        async def wait_until(t):
+            if self.speed > 0:
+                delay = started + t / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        # [next run, interval, coroutine] in recorded time, same intervals as the cog's task loops
+        periodic = [[1.0, 1.0, self.chess_tick], [2.0, 2.0, self.outbox_tick]]
+        end = self.records[-1]["t"] if self.records else 0.0
+        dispatched = [r for r in self.records if r["kind"] in ("snapshot", "command", "event")]
+
+        for record in dispatched + [None]:
+            t = end if record is None else record["t"]
+            while True:
+                p = min(periodic, key=lambda x: x[0])
+                if p[0] > t:
+                    break
+                await wait_until(p[0])
+                self.clock.now = self.start_wall + p[0]
+                await p[2]()
+                p[0] += p[1]
+            if record is not None:
+                await wait_until(t)
+                self.clock.now = self.start_wall + t
+                await self.dispatch(record)
+
+        return time.perf_counter() - started
+
+    def report(self, elapsed, peak_memory):
+        ticks = sorted(self.tick_times)
+
+        def percentile(q):
+            return ticks[min(len(ticks) - 1, int(q * len(ticks)))] * 1000 if ticks else 0.0
+
+        end = self.records[-1]["t"] if self.records else 0.0
+        print(f"Replayed {end:.1f}s of traffic in {elapsed:.1f}s (speed {self.speed}x)")
+        print(f"Ticks : {len(ticks)}, p50 {percentile(0.5):.2f} ms, p95 {percentile(0.95):.2f} ms, "
+              f"max {percentile(1.0):.2f} ms")
+        print(f"Peak memory : {peak_memory / 1024 ** 2:.2f} MB")
+        print(f"Outbox pending : {len(self.cog.outbox)}")
+        print(tabulate(sorted(self.counters.items()), headers=["Counter", "Count"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a dChess traffic capture")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 = no waiting")
+    args = parser.parse_args()
+
+    replay = Replay(traffic.load(args.path), speed=args.speed)
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tracemalloc.start()
+        replay.setup_cog(loop, os.path.join(tmp_dir, "outbox.json"))
+        elapsed = loop.run_until_complete(replay.run())
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    replay.report(elapsed, peak_memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 import time
 import traceback
 import timeago as timesince
+from . import logger
+
+log = logger.get()
 
 
 def print_error(ctx, exception):
-    print(f"Error on '{ctx.message.content}' : {exception}")
+    log.error("error on '%s' : %s", ctx.message.content, exception,
+              extra={"guild_id": ctx.guild.id if ctx.guild else None})
 
 
 def traceback_maker(err, advance: bool = True):
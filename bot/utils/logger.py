@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOGGER_NAME = "dchess"
+FIELDS = ("game_id", "guild_id", "shard_id", "endpoint")
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+
+
+class DedupFilter(logging.Filter):
+    """ Lets the first of a run of identical records through and suppresses the rest for `window`
+        seconds, the next one after the window reports how many were suppressed.
+        Context fields are part of the key, so the same error from different games is kept apart.
+    """
+
+    def __init__(self, window=60.0, max_keys=10000):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self.seen = {}
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = (record.name, record.levelno, record.getMessage(), *(getattr(record, f, None) for f in FIELDS))
+        entry = self.seen.get(key)
+        if entry is not None and now - entry[0] < self.window:
+            entry[1] += 1
+            return False
+
+        if entry is not None and entry[1] > 0:
+            record.msg = f"{record.getMessage()} (repeated {entry[1]} times)"
+            record.args = None
+        self.seen[key] = [now, 0]
+
+        if len(self.seen) > self.max_keys:
+            self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+            if len(self.seen) > self.max_keys // 2:
+                self.seen = {}
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """ Hands the raw record to the listener thread, formatting happens there.
+        Duplicates are dropped before they reach the queue, and if the queue is full the record is
+        dropped instead of blocking the event loop.
+    """
+
+    def __init__(self, log_queue, dedup_window=60.0):
+        super().__init__(log_queue)
+        self.dedup = DedupFilter(window=dedup_window)
+        self.dropped = 0
+
+    def emit(self, record):
+        # called with the handler lock held, so the dedup state is safe from executor threads
+        if self.dedup.filter(record):
+            super().emit(record)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def take_summary(self, force=False):
+        """ Returns records for log loss that hasn't been reported yet: dropped records and suppressed
+            repeats whose window has ended (or all of them if `force`), resets the counts
+        """
+        now = time.monotonic()
+        records = []
+        self.acquire()
+        try:
+            if self.dropped:
+                records.append(logging.makeLogRecord({"name": LOGGER_NAME, "levelno": logging.WARNING,
+                                                      "levelname": "WARNING",
+                                                      "msg": f"dropped {self.dropped} log records, queue full"}))
+                self.dropped = 0
+            for key, entry in self.dedup.seen.items():
+                if entry[1] > 0 and (force or now - entry[0] >= self.dedup.window):
+                    name, levelno, message = key[:3]
+                    records.append(logging.makeLogRecord({"name": name, "levelno": levelno,
+                                                          "levelname": logging.getLevelName(levelno),
+                                                          "msg": f"{message} (repeated {entry[1]} times)",
+                                                          **dict(zip(FIELDS, key[3:]))}))
+                    entry[1] = 0
+        finally:
+            self.release()
+        return records
+
+
+class ReportingQueueListener(QueueListener):
+    """ Logs what the queue handler dropped or suppressed, checked when records come in and at stop() """
+
+    def __init__(self, log_queue, queue_handler, *handlers, interval=10.0):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.interval = interval
+        self.last_report = time.monotonic()
+
+    def handle(self, record):
+        super().handle(record)
+        if time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self, force=False):
+        self.last_report = time.monotonic()
+        for record in self.queue_handler.take_summary(force=force):
+            super().handle(record)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        self.report(force=True)
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Appends known context fields (game id, guild id, shard id, endpoint) as key=value pairs """
+
+    def format(self, record):
+        message = super().format(record)
+        context = " ".join(f"{f}={getattr(record, f)}" for f in FIELDS if getattr(record, f, None) is not None)
+        if not context:
+            return message
+        # keep the traceback (if any) after the context fields
+        head, sep, tail = message.partition("\n")
+        return f"{head} [{context}]{sep}{tail}"
+
+
+def setup(path="logs/dchess.log", level=logging.INFO, max_bytes=5 * 1024 ** 2, backup_count=5,
+          queue_size=10000, dedup_window=60.0):
+    global _listener
+    if _listener is not None:
+        return
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    formatter = StructuredFormatter(FORMAT)
+
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf8')
+    stream_handler = logging.StreamHandler(sys.stderr)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.propagate = False
+    queue_handler = NonBlockingQueueHandler(log_queue, dedup_window=dedup_window)
+    logger.addHandler(queue_handler)
+
+    _listener = ReportingQueueListener(log_queue, queue_handler, file_handler, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get(name=None):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
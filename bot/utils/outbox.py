@@ -0,0 +1,152 @@
+import json
+import os
+import time
+from operator import itemgetter
+from . import logger
+
+log = logger.get("outbox")
+
+
+class Outbox:
+    """ Durable queue for service writes.
+
+        Items are keyed by (endpoint, match_id) so a newer report for the same match replaces the
+        pending one (debounce). Pending items are written to disk on every change and reloaded on
+        startup, failed sends are retried with exponential backoff. Items that fail `max_attempts` times
+        are moved to a dead letter file (`<path>.dead`, one JSON item per line) so later reports for the
+        same match aren't blocked.
+    """
+
+    def __init__(self, path, debounce=5.0, base_backoff=2.0, max_backoff=300.0, batch_size=20,
+                 max_attempts=20):
+        self.path = path
+        self.dead_path = f"{path}.dead"
+        self.max_attempts = max_attempts
+        self.debounce = debounce
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.items = {}
+        self.seq = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def is_valid(item):
+        return (isinstance(item, dict)
+                and all(isinstance(item.get(k), str) for k in ('key', 'endpoint', 'match_id'))
+                and isinstance(item.get('content'), dict)
+                and all(isinstance(item.get(k), int) for k in ('seq', 'attempts'))
+                and isinstance(item.get('due'), (int, float)))
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            items = None
+            log.error("error while loading outbox : %s", e)
+
+        if not isinstance(items, list):
+            # keep the unreadable file around for inspection instead of failing the cog
+            bad_path = f"{self.path}.bad.{int(time.time())}"
+            os.replace(self.path, bad_path)
+            log.error("outbox file isn't a list of items, moved it to %s", bad_path)
+            return
+
+        for item in items:
+            if not self.is_valid(item):
+                log.error("skipping malformed outbox item : %r", item)
+                with open(self.dead_path, "a", encoding='utf8') as f:
+                    f.write(json.dumps(item) + "\n")
+                continue
+            self.items[item['key']] = item
+            self.seq = max(self.seq, item['seq'] + 1)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding='utf8') as f:
+            json.dump(list(self.items.values()), f)
+        os.replace(tmp_path, self.path)
+
+    def put(self, endpoint: str, match_id: str, content: dict, immediate: bool = False):
+        now = time.time()
+        key = f"{endpoint}:{match_id}"
+        due = now if immediate else now + self.debounce
+
+        if immediate:
+            # anything queued earlier for this match has to go out first, don't keep it waiting
+            for item in self.items.values():
+                if item['match_id'] == match_id and item['attempts'] == 0:
+                    item['due'] = min(item['due'], now)
+
+        self.items[key] = {"key": key,
+                           "endpoint": endpoint,
+                           "match_id": match_id,
+                           "content": content,
+                           "seq": self.seq,
+                           "due": due,
+                           "attempts": 0}
+        self.seq += 1
+        self.save()
+
+    def dead_letter(self, item):
+        log.error("giving up on %s after %s attempts", item['key'], item['attempts'],
+                  extra={"game_id": item['match_id'], "endpoint": item['endpoint']})
+        with open(self.dead_path, "a", encoding='utf8') as f:
+            f.write(json.dumps(item) + "\n")
+
+    async def flush(self, send):
+        """ Sends due items in queue order, `send(endpoint, content)` returns the service response.
+            None (transport failure), an exception or a response without `success` counts as a failure.
+            The pass stops at the first transport failure so a service that is down isn't hit with the whole batch.
+        """
+        if not self.items:
+            return
+
+        now = time.time()
+        batch = []
+        seen_matches = set()
+        for item in sorted(self.items.values(), key=itemgetter('seq')):
+            # keep per-match ordering, later reports wait for earlier ones
+            if item['match_id'] in seen_matches:
+                continue
+            seen_matches.add(item['match_id'])
+            if item['due'] <= now:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+
+        if not batch:
+            return
+
+        for item in batch:
+            try:
+                response = await send(item['endpoint'], item['content'])
+            except Exception as e:
+                log.exception("error while sending outbox item %s : %s", item['key'], e,
+                              extra={"game_id": item['match_id'], "endpoint": item['endpoint']})
+                response = False
+
+            current = self.items.get(item['key']) is item
+            if response and response.get('success'):
+                if current:
+                    # item may have been replaced by a newer report while we were sending
+                    del self.items[item['key']]
+                continue
+
+            item['attempts'] += 1
+            if item['attempts'] >= self.max_attempts:
+                self.dead_letter(item)
+                if current:
+                    del self.items[item['key']]
+                continue
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** item['attempts'])
+            item['due'] = time.time() + backoff
+            if response is None:
+                break
+        self.save()
@@ -0,0 +1,122 @@
+import os
+import signal
+import sysconfig
+import threading
+import time
+from collections import Counter
+from inspect import CO_COROUTINE
+
+MAX_DURATION = 60.0
+MAX_DEPTH = 64
+MAX_OVERHEAD = 0.05
+LIBRARY_PATHS = tuple({os.path.realpath(path) for name, path in sysconfig.get_paths().items()
+                       if name in ("stdlib", "platstdlib", "purelib", "platlib")})
+
+
+class SamplingProfiler:
+    """ Samples the main (event loop) thread with SIGPROF, driven by the process CPU time (ITIMER_PROF).
+
+        The signal handler runs in the main thread and reads the interrupted frame, so samples aren't
+        biased towards points where the loop releases the GIL. Each sample is prefixed with the innermost
+        coroutine outside stdlib/site-packages that was called from library code, e.g. chess_task_loop
+        (under Loop._loop), a command callback (under Command.invoke) or a listener (under _run_event).
+        If the handler's own CPU time exceeds MAX_OVERHEAD of the sampled CPU time, the interval is doubled
+        and later samples are weighted accordingly.
+    """
+
+    def __init__(self, interval=0.005):
+        self.base_interval = interval
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self.sampled_time = 0.0
+        self.cost = 0.0
+        self.started = None
+        self.deadline = None
+        self.elapsed = 0.0
+        self.running = False
+        self._previous_handler = None
+
+    def start(self, duration):
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("SamplingProfiler must be started from the main thread")
+
+        self.started = time.perf_counter()
+        self.deadline = self.started + min(duration, MAX_DURATION)
+        self._previous_handler = signal.signal(signal.SIGPROF, self._handler)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        self.elapsed = time.perf_counter() - self.started
+        self.running = False
+
+    def _handler(self, signum, frame):
+        t0 = time.thread_time()
+        self._sample(frame)
+        self.cost += time.thread_time() - t0
+        self.sampled_time += self.interval
+
+        if time.perf_counter() > self.deadline:
+            self.stop()
+        elif self.sample_count % 100 == 0 and self.cost > MAX_OVERHEAD * self.sampled_time:
+            self.interval *= 2
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    @property
+    def total_weight(self):
+        return sum(self.samples.values())
+
+    @staticmethod
+    def is_library(code):
+        return code.co_filename.startswith(LIBRARY_PATHS)
+
+    def _sample(self, frame):
+        stack = []
+        task = None
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            caller = frame.f_back
+            if (task is None and code.co_flags & CO_COROUTINE and not self.is_library(code)
+                    and (caller is None or self.is_library(caller.f_code))):
+                task = getattr(code, "co_qualname", code.co_name)
+            frame = caller
+        stack.reverse()
+
+        if task is not None:
+            stack.insert(0, f"task:{task}")
+
+        # after a back-off each sample stands for more CPU time
+        self.samples[";".join(stack)] += round(self.interval / self.base_interval)
+        self.sample_count += 1
+
+    def collapsed(self, max_bytes=None):
+        """ Returns samples in collapsed stack format (flamegraph.pl / speedscope), most frequent first.
+            Stacks past `max_bytes` are left out, returns (text, left out stack count)
+        """
+        lines = []
+        size = 0
+        stacks = self.samples.most_common()
+        for stack, count in stacks:
+            line = f"{stack} {count}"
+            size += len(line) + 1
+            if max_bytes is not None and size > max_bytes:
+                break
+            lines.append(line)
+        return "\n".join(lines), len(stacks) - len(lines)
+
+    def hotspots(self, top=10):
+        """ Returns [(frame, self weight, total weight)] sorted by self weight """
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for f in set(frames):
+                total_counts[f] += count
+        return [(f, c, total_counts[f]) for f, c in self_counts.most_common(top)]
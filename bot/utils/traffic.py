@@ -0,0 +1,112 @@
+import functools
+import gzip
+import json
+import time
+from io import BytesIO
+
+
+def encode(obj):
+    """ Reduces discord objects to {"id", "name"} so captures stay small and JSON serializable """
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [encode(o) for o in obj]
+    if isinstance(obj, dict):
+        return {str(k): encode(v) for k, v in obj.items()}
+    if isinstance(obj, BytesIO):
+        return {"__bytes__": len(obj.getbuffer())}
+    if hasattr(obj, "id"):
+        return {"id": obj.id, "name": str(obj)}
+    return str(obj)
+
+
+def encode_game(game):
+    msg = game["msg"]
+    snapshot = {k: encode(v) for k, v in game.items() if k != "msg"}
+    snapshot.update(message_id=msg.id, channel_id=msg.channel.id, guild=encode(msg.guild))
+    return snapshot
+
+
+def request_methods(cog):
+    return [name for name in dir(cog) if name.startswith("send_") and name.endswith("_request")]
+
+
+class Recorder:
+    """ Captures service requests and discord events handled by the DChess cog into a gzipped JSON lines file.
+
+        Every line has `t` (seconds since start) and `kind` ("start", "snapshot", "request", "event" or "command").
+        Games already running when recording starts are written as a snapshot, later events are only
+        recorded for game messages.
+    """
+
+    def __init__(self, path, buffer_size=200):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+        self.cog = None
+        self.started = time.perf_counter()
+        self.write({"kind": "start", "wall": time.time()})
+
+    def attach(self, cog):
+        self.cog = cog
+        for name in request_methods(cog):
+            setattr(cog, name, self.wrap_request(name, getattr(cog, name)))
+        cog.recorder = self
+        self.write({"kind": "snapshot", "games": [encode_game(g) for g in cog.games]})
+
+    def detach(self):
+        if self.cog is not None:
+            for name in request_methods(self.cog):
+                if name in vars(self.cog):
+                    delattr(self.cog, name)
+            self.cog.recorder = None
+            self.cog = None
+        self.flush()
+
+    def wrap_request(self, name, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            response = await method(*args, **kwargs)
+            self.write({"kind": "request",
+                        "name": name,
+                        "args": encode(args),
+                        "kwargs": encode(kwargs),
+                        "response": encode(response),
+                        "duration": time.perf_counter() - t0}, t=t0)
+            return response
+        return wrapper
+
+    def record_event(self, name, **fields):
+        self.write({"kind": "event", "name": name, **encode(fields)})
+
+    def record_command(self, ctx):
+        self.write({"kind": "command",
+                    "name": ctx.command.name,
+                    "author": encode(ctx.author),
+                    "guild": encode(ctx.guild),
+                    "channel_id": ctx.channel.id,
+                    "mentions": encode(ctx.message.mentions),
+                    "args": encode(ctx.args[2:]),
+                    "kwargs": encode(ctx.kwargs)})
+
+    def write(self, record, t=None):
+        record["t"] = round((time.perf_counter() if t is None else t) - self.started, 4)
+        self.buffer.append(json.dumps(record, separators=(',', ':')))
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with gzip.open(self.path, "at", encoding='utf8') as f:
+            f.write("\n".join(self.buffer) + "\n")
+        self.buffer = []
+
+
+def load(path):
+    with gzip.open(path, "rt", encoding='utf8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["t"])